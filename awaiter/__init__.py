@@ -1,3 +1,10 @@
-from .ast.decorator import use_awaiter  # NOQA
-from .awaitable import detach, dispatch_to_executor, dispatch_to_loop  # NOQA
+from .ast.decorator import use_awaiter, warm_up_awaiters  # NOQA
+from .awaitable import (  # NOQA
+    detach,
+    dispatch_to_executor,
+    dispatch_to_loop,
+    fan_out,
+)
 from .protocol import Awaiter  # NOQA
+from .remote import RemotePool, dispatch_to_remote  # NOQA
+from .sync import Event, Lock, Queue, Semaphore  # NOQA
@@ -0,0 +1,24 @@
+"""Helpers for closure cells.
+
+NOTE: `types.CellType` is only available in Python 3.8 or later.
+"""
+
+from typing import Any
+
+_EMPTY: Any = object()
+
+
+def make_cell(value: Any = _EMPTY) -> Any:
+    """Create a new closure cell, which is left empty if `value` is omitted."""
+
+    def get() -> Any:
+        return value
+
+    assert get.__closure__ is not None
+    cell = get.__closure__[0]
+    if value is _EMPTY:
+        del cell.cell_contents
+    return cell
+
+
+CellType: type = type(make_cell(None))
@@ -1,25 +1,39 @@
 import ast
-from itertools import count
-from typing import List, Sequence
+from typing import List, Optional, Sequence, Union
 
 from .._types import TASTNode
 from .local_variable_visitor import LocalVariableVisitor
 
 
-def _create_async_function(name: str, body: Sequence[ast.stmt]) -> ast.AsyncFunctionDef:
+def _empty_arguments() -> ast.arguments:
+    return ast.arguments(
+        posonlyargs=[],
+        args=[],
+        kwonlyargs=[],
+        kw_defaults=[],
+        defaults=[],
+        vararg=None,
+        kwarg=None,
+    )
+
+
+def _arguments(arg_names: Sequence[str], lineno: int, col_offset: int) -> ast.arguments:
+    arguments = _empty_arguments()
+    arguments.args = [
+        ast.arg(arg=arg_name, annotation=None, lineno=lineno, col_offset=col_offset)
+        for arg_name in arg_names
+    ]
+    return arguments
+
+
+def _create_async_function(
+    name: str, arg_names: Sequence[str], body: Sequence[ast.stmt]
+) -> ast.AsyncFunctionDef:
     assert len(body) > 0
     return ast.AsyncFunctionDef(
         name=name,
-        args=ast.arguments(
-            posonlyargs=[],
-            args=[],
-            kwonlyargs=[],
-            kw_defaults=[],
-            defaults=[],
-            vararg=None,
-            kwarg=None,
-        ),
-        body=body,
+        args=_arguments(arg_names, body[0].lineno, body[0].col_offset),
+        body=list(body),
         decorator_list=[],
         lineno=body[0].lineno,
         col_offset=body[0].col_offset,
@@ -30,47 +44,131 @@ def _is_await_expr_statement(statement: ast.stmt) -> bool:
     return isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Await)
 
 
+def _name(id: str, ctx: ast.expr_context, lineno: int, col_offset: int) -> ast.Name:
+    return ast.Name(id=id, ctx=ctx, lineno=lineno, col_offset=col_offset)
+
+
+def _call_with_state_expr(
+    func_id: str, state: Union[int, str], lineno: int, col_offset: int
+) -> ast.Call:
+    # Call `func_id` with a state given by a constant or a variable name
+    state_expr: ast.expr
+    if isinstance(state, int):
+        state_expr = ast.Constant(
+            value=state, kind=None, lineno=lineno, col_offset=col_offset
+        )
+    else:
+        state_expr = _name(state, ast.Load(), lineno, col_offset)
+
+    return ast.Call(
+        func=_name(func_id, ast.Load(), lineno, col_offset),
+        args=[state_expr],
+        keywords=[],
+        lineno=lineno,
+        col_offset=col_offset,
+    )
+
+
 def _check_and_call_awaiter_statement(
-    name: str, expr: ast.Await, continuation_id: str
+    name: str, expr: ast.Await, resume_id: str, state_id: str, next_state: int
 ) -> List[ast.stmt]:
-    awaitable_id = f"{name}_awaitable"
-    awaiter_id = f"{name}_awaiter"
-
-    awaitable_obj = ast.Name(
-        id=awaitable_id,
-        lineno=expr.lineno,
-        col_offset=expr.col_offset,
-        ctx=ast.Store(),
-    )
-    ret: List[ast.stmt] = []
-    ret.append(
-        ast.Assign(
-            targets=[awaitable_obj],
-            value=expr.value,
-            lineno=expr.lineno,
-            col_offset=expr.col_offset,
+    """Build the statements that dispatch `expr` to its awaiter.
+
+    The statements are equivalent to the following code, but they are built
+    directly from AST nodes instead of parsing a code string for each await:
+
+        {awaitable_id} = {expr}
+        {awaiter_id} = getattr({awaitable_id}, '__awaiter__', None)
+        if {awaiter_id} is None:
+            await {awaitable_id}
+            {state_id} = {next_state}
+            continue
+        return await {awaiter_id}({resume_id}({next_state}))
+    """
+    awaitable_id = f"_{name}_awaitable"
+    awaiter_id = f"_{name}_awaiter"
+    lineno = expr.lineno
+    col_offset = expr.col_offset
+
+    def load(id: str) -> ast.Name:
+        return _name(id, ast.Load(), lineno, col_offset)
+
+    def store(id: str) -> ast.Name:
+        return _name(id, ast.Store(), lineno, col_offset)
+
+    def constant(value: Union[str, int, None]) -> ast.Constant:
+        return ast.Constant(
+            value=value, kind=None, lineno=lineno, col_offset=col_offset
         )
-    )
-    code = f"""{awaiter_id} = getattr({awaitable_id}, '__awaiter__', None)
-if {awaiter_id} is None:
-    await {awaitable_id}
-    return await {continuation_id}()
-else:
-    return await {awaiter_id}({continuation_id})"""
-    node: ast.Module = ast.parse(code)
-    ret.extend(node.body)
 
-    return ret
+    def await_(value: ast.expr) -> ast.Await:
+        return ast.Await(value=value, lineno=lineno, col_offset=col_offset)
 
+    def call(func: ast.expr, args: List[ast.expr]) -> ast.Call:
+        return ast.Call(
+            func=func, args=args, keywords=[], lineno=lineno, col_offset=col_offset
+        )
 
-def _split_function_into_continuations(
-    function_name_base: str,
+    return [
+        ast.Assign(
+            targets=[store(awaitable_id)],
+            value=expr.value,
+            lineno=lineno,
+            col_offset=col_offset,
+        ),
+        ast.Assign(
+            targets=[store(awaiter_id)],
+            value=call(
+                load("getattr"),
+                [load(awaitable_id), constant("__awaiter__"), constant(None)],
+            ),
+            lineno=lineno,
+            col_offset=col_offset,
+        ),
+        ast.If(
+            test=ast.Compare(
+                left=load(awaiter_id),
+                ops=[ast.Is()],
+                comparators=[constant(None)],
+                lineno=lineno,
+                col_offset=col_offset,
+            ),
+            body=[
+                ast.Expr(
+                    value=await_(load(awaitable_id)),
+                    lineno=lineno,
+                    col_offset=col_offset,
+                ),
+                ast.Assign(
+                    targets=[store(state_id)],
+                    value=constant(next_state),
+                    lineno=lineno,
+                    col_offset=col_offset,
+                ),
+                ast.Continue(lineno=lineno, col_offset=col_offset),
+            ],
+            orelse=[],
+            lineno=lineno,
+            col_offset=col_offset,
+        ),
+        _return_statement(
+            await_(
+                call(
+                    load(awaiter_id),
+                    [_call_with_state_expr(resume_id, next_state, lineno, col_offset)],
+                )
+            ),
+            lineno,
+            col_offset,
+        ),
+    ]
+
+
+def _split_function_into_fragments(
     statements: Sequence[ast.stmt],
-    local_vars: Sequence[str],
-) -> List[ast.AsyncFunctionDef]:
-    continuations: List[ast.AsyncFunctionDef] = []
+) -> List[List[ast.stmt]]:
+    fragments: List[List[ast.stmt]] = []
     i = 0
-    counter = count()
     n_statements = len(statements)
 
     while i < n_statements:
@@ -81,70 +179,155 @@ def _split_function_into_continuations(
             if _is_await_expr_statement(statement):
                 break
 
-        # should -1 at the end
         fragment = list(statements[i : i + j])
         i += j
         assert len(fragment) > 0
-        if len(local_vars) > 0:
-            non_local = ast.Nonlocal(
-                names=list(local_vars),
-                lineno=fragment[0].lineno,
-                col_offset=fragment[0].col_offset,
-            )
-            fragment.insert(0, non_local)
-        continuations.append(
-            _create_async_function(
-                f"_{function_name_base}_continuation_{next(counter)}",
-                fragment,
-            )
-        )
-    return continuations
+        fragments.append(fragment)
+    return fragments
 
 
-def _chain_continuations(
-    src: ast.AsyncFunctionDef,
-    to: ast.AsyncFunctionDef,
-) -> None:
-    last_statement = src.body[-1]
-    if _is_await_expr_statement(last_statement):
+def _chain_fragment(
+    name: str,
+    fragment: List[ast.stmt],
+    resume_id: str,
+    state_id: str,
+    next_state: Optional[int],
+) -> List[ast.stmt]:
+    last_statement = fragment[-1]
+    if next_state is not None and _is_await_expr_statement(last_statement):
         assert isinstance(last_statement, ast.Expr)
         assert isinstance(last_statement.value, ast.Await)
-        src.body.pop(-1)
-        src.body.extend(
-            _check_and_call_awaiter_statement(src.name, last_statement.value, to.name),
+        return fragment[:-1] + _check_and_call_awaiter_statement(
+            name, last_statement.value, resume_id, state_id, next_state
         )
-    else:
-        expr = _await_call_function_expr(to.name, src.lineno, src.col_offset)
-        src.body.append(
-            _return_statement(
-                expr,
-                last_statement.lineno,
-                last_statement.col_offset,
-            )
+
+    if isinstance(last_statement, (ast.Return, ast.Raise)):
+        return fragment
+
+    # NOTE: The last fragment must not fall through to the next loop iteration
+    return fragment + [
+        _return_statement(
+            ast.Constant(
+                value=None,
+                kind=None,
+                lineno=last_statement.lineno,
+                col_offset=last_statement.col_offset,
+            ),
+            last_statement.lineno,
+            last_statement.col_offset,
         )
+    ]
 
 
-def _await_call_function_expr(
-    name: str,
-    lineno: int,
-    col_offset: int,
-) -> ast.Await:
-    return ast.Await(
-        value=ast.Call(
-            func=ast.Name(
-                id=name,
+def _build_dispatch_tree(
+    state_id: str, fragments: Sequence[List[ast.stmt]], begin: int, end: int
+) -> List[ast.stmt]:
+    # Dispatch to a fragment by binary search over the state, so that both
+    # the depth of the generated code and the cost of each hop are logarithmic
+    if end - begin == 1:
+        return fragments[begin]
+
+    mid = (begin + end) // 2
+    lineno = fragments[begin][0].lineno
+    col_offset = fragments[begin][0].col_offset
+    return [
+        ast.If(
+            test=ast.Compare(
+                left=_name(state_id, ast.Load(), lineno, col_offset),
+                ops=[ast.Lt()],
+                comparators=[
+                    ast.Constant(
+                        value=mid, kind=None, lineno=lineno, col_offset=col_offset
+                    )
+                ],
                 lineno=lineno,
                 col_offset=col_offset,
-                ctx=ast.Load(),
             ),
-            args=[],
-            keywords=[],
+            body=_build_dispatch_tree(state_id, fragments, begin, mid),
+            orelse=_build_dispatch_tree(state_id, fragments, mid, end),
             lineno=lineno,
             col_offset=col_offset,
-        ),
+        )
+    ]
+
+
+def _create_resume_function(
+    resume_id: str, continuation_id: str, state_id: str, lineno: int, col_offset: int
+) -> ast.FunctionDef:
+    # def {resume_id}({state_id}):
+    #     return lambda: {continuation_id}({state_id})
+    continuation = ast.Lambda(
+        args=_empty_arguments(),
+        body=_call_with_state_expr(continuation_id, state_id, lineno, col_offset),
         lineno=lineno,
         col_offset=col_offset,
     )
+    return ast.FunctionDef(
+        name=resume_id,
+        args=_arguments([state_id], lineno, col_offset),
+        body=[_return_statement(continuation, lineno, col_offset)],
+        decorator_list=[],
+        lineno=lineno,
+        col_offset=col_offset,
+    )
+
+
+def _create_continuation(
+    function_name_base: str,
+    statements: Sequence[ast.stmt],
+    local_vars: Sequence[str],
+) -> List[ast.stmt]:
+    """Create a single continuation that resumes the function from a given state.
+
+    All the fragments between awaits are placed in one function, instead of
+    one function per fragment, and awaiters receive a callable created by
+    a resume function. This keeps the number of names and nested scopes
+    in the original function constant, which makes compilation linear in
+    the number of awaits.
+    """
+    continuation_id = f"_{function_name_base}_continuation"
+    resume_id = f"_{function_name_base}_resume"
+    state_id = f"_{function_name_base}_state"
+    fragments = _split_function_into_fragments(statements)
+    n_fragments = len(fragments)
+    chained = [
+        _chain_fragment(
+            function_name_base,
+            fragment,
+            resume_id,
+            state_id,
+            idx + 1 if idx + 1 < n_fragments else None,
+        )
+        for idx, fragment in enumerate(fragments)
+    ]
+
+    first = statements[0]
+    body: List[ast.stmt] = []
+    if len(local_vars) > 0:
+        body.append(
+            ast.Nonlocal(
+                names=list(local_vars),
+                lineno=first.lineno,
+                col_offset=first.col_offset,
+            )
+        )
+    body.append(
+        ast.While(
+            test=ast.Constant(
+                value=True, kind=None, lineno=first.lineno, col_offset=first.col_offset
+            ),
+            body=_build_dispatch_tree(state_id, chained, 0, n_fragments),
+            orelse=[],
+            lineno=first.lineno,
+            col_offset=first.col_offset,
+        )
+    )
+    return [
+        _create_async_function(continuation_id, [state_id], body),
+        _create_resume_function(
+            resume_id, continuation_id, state_id, first.lineno, first.col_offset
+        ),
+    ]
 
 
 def _return_statement(value: ast.expr, lineno: int, col_offset: int) -> ast.Return:
@@ -164,19 +347,28 @@ class AsyncCPSTransformer(ast.NodeTransformer):
         node = local_var_visitor.visit(node)
         local_vars = local_var_visitor.get_variable_declarations()
 
-        continuations: List[ast.AsyncFunctionDef] = _split_function_into_continuations(
+        continuation = _create_continuation(
             node.name,
             children,
             list(local_vars.keys()),
         )
-        n_continuations = len(continuations)
-        for idx in range(n_continuations - 1):
-            _chain_continuations(continuations[idx], continuations[idx + 1])
 
         node.body = []
         node.body.extend(local_vars.values())
-        node.body.extend(continuations)
-        _chain_continuations(node, continuations[0])
+        node.body.extend(continuation)
+        node.body.append(
+            _return_statement(
+                ast.Await(
+                    value=_call_with_state_expr(
+                        f"_{node.name}_continuation", 0, node.lineno, node.col_offset
+                    ),
+                    lineno=node.lineno,
+                    col_offset=node.col_offset,
+                ),
+                node.lineno,
+                node.col_offset,
+            )
+        )
 
         return node
 
@@ -2,12 +2,13 @@ from __future__ import annotations
 
 import ast
 import inspect
+import logging
 import re
+import threading
 import types
+import weakref
 from functools import partial, wraps
-from typing import Callable, List, Optional, Union, overload
-
-import astor
+from typing import Any, Callable, Dict, List, Optional, Union, overload
 
 from .._types import TAsyncFunction
 from .async_cps_transformer import transform_async_to_cps
@@ -15,6 +16,8 @@ from .decorator_remover import remove_decorator
 
 LEADING_WS_PATTERN = re.compile(r"\s*")
 
+logger = logging.getLogger(__name__)
+
 
 def _remove_leading_whitespaces(source: str) -> str:
     # NOTE: Removing leading whitespace is required to parse code by `ast.parse` method
@@ -36,7 +39,8 @@ def _remove_leading_whitespaces(source: str) -> str:
 def _decorator_impl(
     func: TAsyncFunction,
     deco_name: str,
-    frame: types.FrameType,
+    f_globals: Dict[str, Any],
+    f_locals: Dict[str, Any],
     debug: bool,
 ) -> TAsyncFunction:
     source = inspect.getsource(func)
@@ -47,10 +51,13 @@ def _decorator_impl(
     remove_decorator(func_ast, deco_name)
 
     if debug:
+        # NOTE: Import astor only if required since it is slow to load
+        import astor
+
         print(astor.to_source(func_ast))
 
-    globals = frame.f_globals.copy()
-    globals.update(frame.f_locals)
+    globals = f_globals.copy()
+    globals.update(f_locals)
     recompiled_source = compile(func_ast, "<awaiter>", "exec")
     exec(recompiled_source, globals)
 
@@ -58,6 +65,143 @@ def _decorator_impl(
     return new_function
 
 
+class _LazyTransformer:
+    """Transform a function on the first request in a thread-safe manner."""
+
+    def __init__(
+        self,
+        func: TAsyncFunction,
+        deco_name: str,
+        frame: types.FrameType,
+        debug: bool,
+    ) -> None:
+        self._func: Optional[Callable[..., Any]] = func
+        self._name = func.__qualname__
+        self._deco_name = deco_name
+        self._f_globals: Optional[Dict[str, Any]] = frame.f_globals
+        # NOTE: Take a snapshot of local variables because they may be changed or
+        # released until the first call. Module-level locals are the globals itself.
+        self._f_locals: Optional[Dict[str, Any]] = (
+            frame.f_locals
+            if frame.f_locals is frame.f_globals
+            else frame.f_locals.copy()
+        )
+        self._debug = debug
+        self._lock = threading.Lock()
+        self._transformed: Optional[Callable[..., Any]] = None
+        self._stub: Optional[types.FunctionType] = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def bind_stub(self, stub: types.FunctionType) -> None:
+        self._stub = stub
+
+    @property
+    def pending(self) -> bool:
+        return self._transformed is None
+
+    def get(self) -> Callable[..., Any]:
+        transformed = self._transformed
+        if transformed is not None:
+            return transformed
+
+        with self._lock:
+            if self._transformed is None:
+                assert self._func is not None
+                assert self._f_globals is not None
+                assert self._f_locals is not None
+                self._transformed = _decorator_impl(
+                    self._func,
+                    self._deco_name,
+                    self._f_globals,
+                    self._f_locals,
+                    self._debug,
+                )
+                if self._stub is not None:
+                    _replace_stub(self._stub, self._transformed)
+                # Release references that are no longer needed
+                self._stub = None
+                self._func = None
+                self._f_globals = None
+                self._f_locals = None
+                _pending_transformers.discard(self)
+
+            return self._transformed
+
+
+_pending_transformers: "weakref.WeakSet[_LazyTransformer]" = weakref.WeakSet()
+
+
+def _replace_stub(stub: types.FunctionType, transformed: Callable[..., Any]) -> None:
+    # Rebind the stub to the transformed function so that later calls run it
+    # directly. This is only possible when the code has no free variables.
+    if not isinstance(transformed, types.FunctionType):
+        return
+    if transformed.__code__.co_freevars != stub.__code__.co_freevars:
+        return
+
+    stub.__globals__.update(transformed.__globals__)
+    stub.__defaults__ = transformed.__defaults__
+    stub.__kwdefaults__ = transformed.__kwdefaults__
+    # NOTE: Replace the code at last since the stub code ignores the defaults
+    stub.__code__ = transformed.__code__
+
+
+# NOTE: The stub looks up the transformer from its own globals instead of a closure,
+# so that its code can be replaced with the transformed one without free variables.
+_LAZY_STUB_CODE = compile(
+    "async def stub(*args, **kwargs):\n"
+    "    return await __awaiter_transformer__.get()(*args, **kwargs)\n",
+    "<awaiter>",
+    "exec",
+)
+
+
+def _create_lazy_stub(
+    func: TAsyncFunction,
+    deco_name: str,
+    frame: types.FrameType,
+    debug: bool,
+) -> TAsyncFunction:
+    transformer = _LazyTransformer(func, deco_name, frame, debug)
+    namespace: Dict[str, Any] = {"__awaiter_transformer__": transformer}
+    exec(_LAZY_STUB_CODE, namespace)
+    transformer.bind_stub(namespace["stub"])
+    _pending_transformers.add(transformer)
+
+    new_function: TAsyncFunction = namespace["stub"]
+    return new_function
+
+
+def _warm_up_pending() -> None:
+    for transformer in list(_pending_transformers):
+        try:
+            transformer.get()
+        except Exception:
+            # Leave it pending so that the error is raised on the first call
+            logger.exception("Failed to transform '%s'", transformer.name)
+
+
+def warm_up_awaiters(*, background: bool = True) -> Optional[threading.Thread]:
+    """Transform all functions decorated with `use_awaiter(lazy=True)`.
+
+    If `background` is True, the transformation runs in a daemon thread
+    and the thread is returned. Otherwise, this function blocks until
+    all the pending functions are transformed.
+    """
+    if not background:
+        _warm_up_pending()
+        return None
+
+    thread = threading.Thread(
+        target=_warm_up_pending, name="awaiter-warm-up", daemon=True
+    )
+    thread.start()
+    return thread
+
+
 @overload
 def use_awaiter(
     func: TAsyncFunction,
@@ -71,6 +215,7 @@ def use_awaiter(
     *,
     deco_name: str = ...,
     debug: bool = ...,
+    lazy: bool = ...,
 ) -> Callable[[TAsyncFunction], TAsyncFunction]:
     ...
 
@@ -80,12 +225,18 @@ def use_awaiter(
     *,
     deco_name: str = "use_awaiter",
     debug: bool = False,
+    lazy: bool = False,
 ) -> Union[TAsyncFunction, partial[TAsyncFunction]]:
     if func is None:
-        return partial(use_awaiter, deco_name=deco_name, debug=debug)
+        return partial(use_awaiter, deco_name=deco_name, debug=debug, lazy=lazy)
 
     frame = inspect.currentframe()
     assert frame is not None
     frame = frame.f_back
     assert frame is not None
-    return wraps(func)(_decorator_impl(func, deco_name, frame, debug))
+    if lazy:
+        return wraps(func)(_create_lazy_stub(func, deco_name, frame, debug))
+
+    return wraps(func)(
+        _decorator_impl(func, deco_name, frame.f_globals, frame.f_locals, debug)
+    )
@@ -1,19 +1,27 @@
 import ast
-
-import astor
+from typing import Sequence
 
 from .._types import TASTNode
 
 
+def _match_dotted_name(expr: ast.expr, parts: Sequence[str]) -> bool:
+    # Compare `expr` with a dotted name (e.g. `awaiter.use_awaiter`) structurally
+    for part in reversed(parts[1:]):
+        if not isinstance(expr, ast.Attribute) or expr.attr != part:
+            return False
+        expr = expr.value
+
+    return isinstance(expr, ast.Name) and expr.id == parts[0]
+
+
 def _remove_decorator(node: ast.AsyncFunctionDef, deco_name: str) -> None:
+    parts = [part.strip() for part in deco_name.split(".")]
     for idx, deco in enumerate(node.decorator_list):
         assert isinstance(deco, ast.expr)
         if isinstance(deco, ast.Call):
-            expr_str = astor.to_source(deco.func).strip()
-        else:
-            expr_str = astor.to_source(deco).strip()
+            deco = deco.func
 
-        if expr_str == deco_name:
+        if _match_dotted_name(deco, parts):
             node.decorator_list.pop(idx)
             break
     else:
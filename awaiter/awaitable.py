@@ -1,8 +1,29 @@
 from __future__ import annotations
 
 import asyncio
+import contextvars
+import math
+import re
+import types
 from concurrent.futures import Executor, ThreadPoolExecutor
-from typing import Any, Callable, Coroutine, Generator, Generic, Optional, TypeVar
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Generator,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from ._cell import make_cell
 
 T = TypeVar("T")
 TResult = TypeVar("TResult")
@@ -78,3 +99,220 @@ class _DetachAwaitable(Generic[T]):
 
 def detach() -> _DetachAwaitable[Any]:
     return _DetachAwaitable()
+
+
+HopTarget = Union[Executor, asyncio.AbstractEventLoop]
+
+_fan_out_chunk: contextvars.ContextVar[Sequence[Any]] = contextvars.ContextVar(
+    "_fan_out_chunk"
+)
+
+
+def _hop_awaitable(
+    target: HopTarget,
+) -> Union[_ExecutorAwaitable, _EventLoopAwaitable]:
+    if isinstance(target, asyncio.AbstractEventLoop):
+        return _EventLoopAwaitable(target)
+    elif isinstance(target, Executor):
+        return _ExecutorAwaitable(target)
+    else:
+        raise TypeError(f"Unsupported hop target: {target!r}")
+
+
+# Qualified name of the callable created by `_<name>_resume` of `use_awaiter`
+_RESUME_LAMBDA_PATTERN = re.compile(
+    r"(?:.+\.)?(?P<name>[^.]+)\.<locals>\._(?P=name)_resume\.<locals>\.<lambda>"
+)
+
+
+def _clone_continuation(continuation: Callable[..., Any]) -> Callable[..., Any]:
+    """Copy a continuation so that it has its own local variables.
+
+    Continuations generated by `use_awaiter` share the local variables of
+    the decorated function through closure cells. Only the cells of the generated
+    `_<name>_continuation` and `_<name>_resume` functions are cloned, and any other
+    object (including closures given by the caller) is shared by reference.
+    """
+    if not isinstance(continuation, types.FunctionType):
+        return continuation
+
+    match = _RESUME_LAMBDA_PATTERN.fullmatch(continuation.__qualname__)
+    if match is None:
+        return continuation
+
+    name = match.group("name")
+    generated_names = {f"_{name}_continuation", f"_{name}_resume"}
+    cells: Dict[int, Any] = {}
+    functions: Dict[int, types.FunctionType] = {}
+
+    def is_generated(value: Any) -> bool:
+        return (
+            isinstance(value, types.FunctionType)
+            and value.__name__ in generated_names
+            and value.__qualname__.split(".")[-3:] == [name, "<locals>", value.__name__]
+        )
+
+    def clone_cell(cell: Any) -> Any:
+        cloned = cells.get(id(cell))
+        if cloned is not None:
+            return cloned
+
+        cloned = make_cell()
+        cells[id(cell)] = cloned
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            # Not assigned yet
+            return cloned
+
+        if is_generated(value):
+            value = clone_function(value)
+        cloned.cell_contents = value
+        return cloned
+
+    def clone_function(func: types.FunctionType) -> types.FunctionType:
+        cloned = functions.get(id(func))
+        if cloned is not None:
+            return cloned
+
+        cloned = types.FunctionType(
+            func.__code__,
+            func.__globals__,
+            func.__name__,
+            func.__defaults__,
+            tuple(clone_cell(c) for c in func.__closure__ or ()),
+        )
+        cloned.__kwdefaults__ = func.__kwdefaults__
+        cloned.__qualname__ = func.__qualname__
+        functions[id(func)] = cloned
+        return cloned
+
+    return clone_function(continuation)
+
+
+class _ChunkPartitioner(Generic[T]):
+    """Hand out chunks of ``items`` with guided (decreasing) sizes.
+
+    Early chunks are large to keep the number of hops low, and later ones
+    shrink so that workers finish at roughly the same time.
+    """
+
+    def __init__(self, items: Sequence[T], n_workers: int, min_chunk_size: int) -> None:
+        self._items = items
+        self._n_workers = n_workers
+        self._min_chunk_size = min_chunk_size
+        self._offset = 0
+        self._counter = 0
+        self._closed = False
+
+    def close(self) -> None:
+        """Stop handing out chunks."""
+        self._closed = True
+
+    def next_chunk(self) -> Optional[Tuple[int, Sequence[T]]]:
+        if self._closed:
+            return None
+
+        remaining = len(self._items) - self._offset
+        if remaining <= 0:
+            return None
+
+        size = max(self._min_chunk_size, math.ceil(remaining / (2 * self._n_workers)))
+        chunk = self._items[self._offset : self._offset + size]
+        self._offset += len(chunk)
+        index = self._counter
+        self._counter += 1
+        return index, chunk
+
+
+class _FanOutAwaitable(Generic[T]):
+    def __init__(
+        self,
+        items: Sequence[T],
+        targets: Sequence[HopTarget],
+        min_chunk_size: int,
+    ) -> None:
+        if len(targets) == 0:
+            raise ValueError("At least one hop target is required")
+        if min_chunk_size < 1:
+            raise ValueError("min_chunk_size must be a positive integer")
+
+        self._items = items
+        self._hops = [_hop_awaitable(t) for t in targets]
+        self._min_chunk_size = min_chunk_size
+
+    def __await__(self) -> Generator[None, None, Any]:
+        raise RuntimeError(
+            "Do not call __await__ of this object. "
+            "Make sure that your function has a @use_awaiter decorator"
+        )
+
+    @property
+    def chunk(self) -> Sequence[T]:
+        """The chunk assigned to the currently running continuation."""
+        try:
+            return _fan_out_chunk.get()
+        except LookupError:
+            raise RuntimeError(
+                "No chunk is assigned. "
+                "Access `chunk` only after awaiting this object"
+            ) from None
+
+    async def __awaiter__(
+        self, continuation: Callable[[], Coroutine[Any, Any, TResult]]
+    ) -> List[TResult]:
+        partitioner = _ChunkPartitioner(
+            self._items, len(self._hops), self._min_chunk_size
+        )
+        results: List[Tuple[int, TResult]] = []
+
+        async def run_chunk(
+            chunk_continuation: Callable[[], Coroutine[Any, Any, TResult]],
+            chunk: Sequence[T],
+        ) -> TResult:
+            _fan_out_chunk.set(chunk)
+            return await chunk_continuation()
+
+        async def worker(hop: Union[_ExecutorAwaitable, _EventLoopAwaitable]) -> None:
+            while True:
+                # NOTE: The partitioner is only touched from the caller's loop,
+                # so no lock is required here
+                next_chunk = partitioner.next_chunk()
+                if next_chunk is None:
+                    return
+                index, chunk = next_chunk
+                # Each chunk gets its own copy of the local variables
+                chunk_continuation = _clone_continuation(continuation)
+                result = await hop.__awaiter__(
+                    partial(run_chunk, chunk_continuation, chunk)
+                )
+                results.append((index, result))
+
+        tasks = [asyncio.ensure_future(worker(hop)) for hop in self._hops]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # NOTE: If a chunk fails, stop the other workers from taking more chunks
+            partitioner.close()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        results.sort(key=lambda r: r[0])
+        return [r for _, r in results]
+
+
+def fan_out(
+    items: Iterable[T],
+    targets: Sequence[HopTarget],
+    *,
+    min_chunk_size: int = 1,
+) -> _FanOutAwaitable[T]:
+    """Run the rest of the function once per chunk of ``items`` across ``targets``.
+
+    Each target is either an executor or an event loop. Inside the continuation,
+    the assigned chunk is available as ``chunk`` of the returned object.
+    Awaiting this object makes the decorated function return a list of
+    the results of each chunk in the original order.
+    """
+    return _FanOutAwaitable(list(items), targets, min_chunk_size)
@@ -0,0 +1,663 @@
+"""Continue a coroutine on a worker process over a socket.
+
+A continuation is serialized with :mod:`pickle`, sent to a worker started by
+``python -m awaiter.worker``, and its result is sent back to the caller.
+Functions that are not importable (e.g. continuations generated by
+`use_awaiter`) are serialized by value together with their closures and
+the global variables they refer to.
+
+Each connection starts with a mutual HMAC challenge-response handshake using
+a shared key (similar to `authkey` of `multiprocessing.connection`), which also
+checks that both sides use the same Python version. Note that the traffic is
+not encrypted, and workers execute any code sent by authenticated callers.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import builtins
+import hashlib
+import hmac
+import importlib
+import io
+import marshal
+import os
+import pickle
+import struct
+import sys
+import threading
+import types
+from concurrent.futures import Executor, Future
+from functools import partial
+from itertools import count
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+from ._cell import CellType, make_cell
+
+TResult = TypeVar("TResult")
+
+Endpoint = Union[Tuple[str, int], str]
+
+# Frame: kind (uint8), request id (uint64), payload length (uint32), payload
+_HEADER = struct.Struct("!BQI")
+_KIND_CALL = 0
+_KIND_RESULT = 1
+_KIND_ERROR = 2
+
+_HANDSHAKE_MAGIC = b"AWAITER1"
+_HANDSHAKE_TIMEOUT = 10.0
+_NONCE_SIZE = 32
+_AUTHKEY_ENV = "AWAITER_AUTHKEY"
+
+
+class AuthenticationError(ConnectionError):
+    pass
+
+
+class _EmptyCell:
+    # Marker of a closure cell that has not been assigned yet
+    pass
+
+
+class _CallerOnlyGlobal:
+    """A placeholder of a global variable that is only available on the caller.
+
+    Using it on the worker raises an error that names the variable.
+    """
+
+    def __init__(self, name: str, type_name: str) -> None:
+        self._name = name
+        self._type_name = type_name
+
+    def __reduce__(self) -> Any:
+        return _CallerOnlyGlobal, (self._name, self._type_name)
+
+    def __repr__(self) -> str:
+        return f"<caller-only global {self._name!r} ({self._type_name})>"
+
+    def _raise(self, *args: Any, **kwargs: Any) -> Any:
+        raise NameError(
+            f"Global variable {self._name!r} ({self._type_name}) is not sent "
+            "to the remote worker since it is only available on the caller"
+        )
+
+    __getattr__ = _raise
+    __call__ = _raise
+    __getitem__ = _raise
+    __iter__ = _raise
+    __bool__ = _raise
+
+
+def _iter_global_names(code: types.CodeType) -> Iterator[str]:
+    yield from code.co_names
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from _iter_global_names(const)
+
+
+def _is_importable(obj: Any) -> bool:
+    module_name = getattr(obj, "__module__", None) or ""
+    # NOTE: `__main__` of the worker is not the one of the caller
+    if module_name == "__main__":
+        return False
+
+    module = sys.modules.get(module_name)
+    if module is None:
+        return False
+
+    value: Any = module
+    for part in obj.__qualname__.split("."):
+        value = getattr(value, part, None)
+    return value is obj
+
+
+def _load_code(data: bytes) -> types.CodeType:
+    code: types.CodeType = marshal.loads(data)
+    return code
+
+
+def _set_cell_contents(cell: Any, value: Any) -> None:
+    if value is not _EmptyCell:
+        cell.cell_contents = value
+
+
+def _make_function(
+    code: types.CodeType, module: str, closure: Tuple[Any, ...]
+) -> types.FunctionType:
+    globals = {"__builtins__": builtins, "__name__": module}
+    return types.FunctionType(code, globals, code.co_name, None, closure)
+
+
+def _make_class(
+    metaclass: Type[Any], name: str, bases: Tuple[type, ...], namespace: Dict[str, Any]
+) -> type:
+    cls: type = metaclass(name, bases, namespace)
+    return cls
+
+
+def _set_class_state(cls: type, state: Dict[str, Any]) -> None:
+    for name, value in state.items():
+        setattr(cls, name, value)
+
+
+def _set_function_state(func: types.FunctionType, state: Dict[str, Any]) -> None:
+    func.__globals__.update(state["globals"])
+    func.__defaults__ = state["defaults"]
+    func.__kwdefaults__ = state["kwdefaults"]
+    func.__qualname__ = state["qualname"]
+
+
+class _Pickler(pickle.Pickler):
+    def reducer_override(self, obj: Any) -> Any:
+        if isinstance(obj, types.ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        elif isinstance(obj, types.CodeType):
+            return _load_code, (marshal.dumps(obj),)
+        elif isinstance(obj, CellType):
+            return self._reduce_cell(obj)
+        elif isinstance(obj, types.FunctionType) and not _is_importable(obj):
+            return self._reduce_function(obj)
+        elif (
+            isinstance(obj, type)
+            and obj.__module__ == "__main__"
+            and not _is_importable(obj)
+        ):
+            return self._reduce_class(obj)
+
+        return NotImplemented
+
+    def _reduce_cell(self, cell: Any) -> Any:
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            value = _EmptyCell
+
+        # NOTE: Cells are shared among continuations to bind `nonlocal` variables.
+        # Restore the contents after the cell is memoized to keep the identity
+        # and to allow recursive references.
+        return make_cell, (), value, None, None, _set_cell_contents
+
+    def _reduce_class(self, cls: type) -> Any:
+        # Classes defined in `__main__` of the caller are sent by value
+        namespace: Dict[str, Any] = {}
+        slots = cls.__dict__.get("__slots__")
+        if slots is not None:
+            namespace["__slots__"] = slots
+
+        state = {
+            name: value
+            for name, value in cls.__dict__.items()
+            if name not in ("__dict__", "__weakref__", "__slots__")
+            and not isinstance(value, types.MemberDescriptorType)
+        }
+        # NOTE: Attributes are set after the class is memoized,
+        # so that methods can refer to the class itself
+        return (
+            _make_class,
+            (type(cls), cls.__name__, cls.__bases__, namespace),
+            state,
+            None,
+            None,
+            _set_class_state,
+        )
+
+    def _reduce_function(self, func: types.FunctionType) -> Any:
+        globals: Dict[str, Any] = {}
+        for name in set(_iter_global_names(func.__code__)):
+            if name not in func.__globals__:
+                continue
+            value = func.__globals__[name]
+            # NOTE: A continuation contains the code before the hop as well,
+            # so it may refer to objects that only make sense on the caller
+            # (e.g. a connection pool). Send placeholders instead of them.
+            if isinstance(value, _CALLER_ONLY_TYPES):
+                value = _CallerOnlyGlobal(name, type(value).__qualname__)
+            globals[name] = value
+        state = {
+            "globals": globals,
+            "defaults": func.__defaults__,
+            "kwdefaults": func.__kwdefaults__,
+            "qualname": func.__qualname__,
+        }
+        return (
+            _make_function,
+            (func.__code__, func.__module__, func.__closure__ or ()),
+            state,
+            None,
+            None,
+            _set_function_state,
+        )
+
+
+def _dumps(obj: Any) -> bytes:
+    buffer = io.BytesIO()
+    _Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buffer.getvalue()
+
+
+def _dumps_error(error: BaseException) -> bytes:
+    try:
+        return _dumps(error)
+    except Exception:
+        return _dumps(RuntimeError(f"Unpicklable error on the worker: {error!r}"))
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    header = await reader.readexactly(_HEADER.size)
+    kind, request_id, length = _HEADER.unpack(header)
+    payload = await reader.readexactly(length)
+    return kind, request_id, payload
+
+
+def _write_frame(
+    writer: asyncio.StreamWriter, kind: int, request_id: int, payload: bytes
+) -> None:
+    writer.writelines([_HEADER.pack(kind, request_id, len(payload)), payload])
+
+
+def _get_authkey(authkey: Optional[bytes]) -> bytes:
+    if authkey is None:
+        authkey = os.environ.get(_AUTHKEY_ENV, "").encode()
+
+    if len(authkey) == 0:
+        raise ValueError(
+            "An authentication key is required. "
+            f"Pass `authkey` or set the {_AUTHKEY_ENV} environment variable"
+        )
+    return authkey
+
+
+def _version_tag() -> bytes:
+    # Code objects are sent with `marshal`, whose format depends on the Python version
+    return f"{sys.implementation.cache_tag}:{marshal.version}".encode()
+
+
+def _digest(authkey: bytes, label: bytes, nonce: bytes, version: bytes) -> bytes:
+    return hmac.new(authkey, label + nonce + version, hashlib.sha256).digest()
+
+
+async def _read_version(reader: asyncio.StreamReader) -> bytes:
+    (length,) = await reader.readexactly(1)
+    return await reader.readexactly(length)
+
+
+async def _client_handshake(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, authkey: bytes
+) -> None:
+    if await reader.readexactly(len(_HANDSHAKE_MAGIC)) != _HANDSHAKE_MAGIC:
+        raise ConnectionError("The peer is not an awaiter worker")
+
+    version = _version_tag()
+    worker_version = await _read_version(reader)
+    if worker_version != version:
+        raise RuntimeError(
+            "Python version mismatch: "
+            f"caller is {version.decode()}, worker is {worker_version.decode()}"
+        )
+
+    worker_nonce = await reader.readexactly(_NONCE_SIZE)
+    nonce = os.urandom(_NONCE_SIZE)
+    writer.writelines(
+        [
+            bytes([len(version)]),
+            version,
+            _digest(authkey, b"caller", worker_nonce, version),
+            nonce,
+        ]
+    )
+    await writer.drain()
+
+    try:
+        response = await reader.readexactly(hashlib.sha256().digest_size)
+    except asyncio.IncompleteReadError:
+        raise AuthenticationError(
+            "The worker rejected the authentication key"
+        ) from None
+    if not hmac.compare_digest(response, _digest(authkey, b"worker", nonce, version)):
+        raise AuthenticationError("Failed to authenticate the worker")
+
+
+async def _worker_handshake(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, authkey: bytes
+) -> bool:
+    version = _version_tag()
+    nonce = os.urandom(_NONCE_SIZE)
+    writer.writelines([_HANDSHAKE_MAGIC, bytes([len(version)]), version, nonce])
+    await writer.drain()
+
+    caller_version = await _read_version(reader)
+    digest = await reader.readexactly(hashlib.sha256().digest_size)
+    caller_nonce = await reader.readexactly(_NONCE_SIZE)
+    if caller_version != version:
+        return False
+    if not hmac.compare_digest(digest, _digest(authkey, b"caller", nonce, version)):
+        return False
+
+    writer.write(_digest(authkey, b"worker", caller_nonce, version))
+    await writer.drain()
+    return True
+
+
+async def _open_connection(
+    endpoint: Endpoint, authkey: bytes
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if isinstance(endpoint, str):
+        reader, writer = await asyncio.open_unix_connection(endpoint)
+    else:
+        host, port = endpoint
+        reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        await asyncio.wait_for(
+            _client_handshake(reader, writer, authkey), _HANDSHAKE_TIMEOUT
+        )
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+class _Connection:
+    """A connection that pipelines multiple requests by their identifiers."""
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._ids = count()
+        self._pending: Dict[int, asyncio.Future[Tuple[int, bytes]]] = {}
+        self._closed = False
+        self._drain_lock = asyncio.Lock()
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def n_pending(self) -> int:
+        return len(self._pending)
+
+    async def call(self, payload: bytes) -> Tuple[int, bytes]:
+        if self._closed:
+            raise ConnectionError("Connection is already closed")
+
+        request_id = next(self._ids)
+        future: asyncio.Future[
+            Tuple[int, bytes]
+        ] = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        _write_frame(self._writer, _KIND_CALL, request_id, payload)
+        async with self._drain_lock:
+            await self._writer.drain()
+        return await future
+
+    async def _read_loop(self) -> None:
+        error: BaseException = ConnectionError("Connection is closed by the worker")
+        try:
+            while True:
+                kind, request_id, payload = await _read_frame(self._reader)
+                future = self._pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result((kind, payload))
+        except asyncio.IncompleteReadError:
+            pass
+        except Exception as e:
+            error = e
+        finally:
+            self._closed = True
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def close(self) -> None:
+        self._closed = True
+        self._writer.close()
+        await self._reader_task
+
+
+class RemotePool:
+    """A pool of connections to remote workers.
+
+    All connections are managed by an event loop running in a dedicated thread,
+    so that continuations on any loop or thread can share them.
+    At most `max_connections` connections are opened for each endpoint, and
+    requests are pipelined on the least busy connection.
+    If `authkey` is not given, the AWAITER_AUTHKEY environment variable is used.
+    """
+
+    def __init__(
+        self, max_connections: int = 4, *, authkey: Optional[bytes] = None
+    ) -> None:
+        if max_connections < 1:
+            raise ValueError("max_connections must be a positive integer")
+
+        self._max_connections = max_connections
+        self._authkey = _get_authkey(authkey)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._connections: Dict[Endpoint, List[_Connection]] = {}
+        self._connecting: Dict[Endpoint, asyncio.Lock] = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=loop.run_forever, name="awaiter-remote", daemon=True
+                )
+                self._thread.start()
+                self._loop = loop
+
+            return self._loop
+
+    async def _acquire(self, endpoint: Endpoint) -> _Connection:
+        connections = self._connections.setdefault(endpoint, [])
+        connections[:] = [c for c in connections if not c.closed]
+        idle = [c for c in connections if c.n_pending == 0]
+        if len(idle) > 0 or len(connections) >= self._max_connections:
+            return min(connections, key=lambda c: c.n_pending)
+
+        lock = self._connecting.setdefault(endpoint, asyncio.Lock())
+        async with lock:
+            if len(connections) < self._max_connections:
+                connections.append(
+                    _Connection(*await _open_connection(endpoint, self._authkey))
+                )
+
+        return min(connections, key=lambda c: c.n_pending)
+
+    async def _call(self, endpoint: Endpoint, payload: bytes) -> Tuple[int, bytes]:
+        connection = await self._acquire(endpoint)
+        return await connection.call(payload)
+
+    def submit(self, endpoint: Endpoint, payload: bytes) -> Future[Tuple[int, bytes]]:
+        return asyncio.run_coroutine_threadsafe(
+            self._call(endpoint, payload), self._get_loop()
+        )
+
+    async def _close_connections(self) -> None:
+        connections = [c for cs in self._connections.values() for c in cs]
+        self._connections.clear()
+        await asyncio.gather(*(c.close() for c in connections))
+
+    def close(self) -> None:
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+
+        if loop is None or thread is None:
+            return
+
+        asyncio.run_coroutine_threadsafe(self._close_connections(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def __enter__(self) -> RemotePool:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+# Objects bound to the caller process, which are never sent to workers
+_CALLER_ONLY_TYPES = (RemotePool, asyncio.AbstractEventLoop, Executor, threading.Thread)
+
+_default_pool: Optional[RemotePool] = None
+_default_pool_lock = threading.Lock()
+
+
+def _get_default_pool() -> RemotePool:
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = RemotePool()
+        return _default_pool
+
+
+class _RemoteAwaitable:
+    def __init__(self, endpoint: Endpoint, pool: Optional[RemotePool]) -> None:
+        self._endpoint = endpoint
+        self._pool = pool
+
+    def __await__(self) -> Generator[None, None, Any]:
+        raise RuntimeError(
+            "Do not call __await__ of this object. "
+            "Make sure that your function has a @use_awaiter decorator"
+        )
+
+    async def __awaiter__(
+        self, continuation: Callable[[], Coroutine[Any, Any, TResult]]
+    ) -> TResult:
+        pool = self._pool if self._pool is not None else _get_default_pool()
+        future = pool.submit(self._endpoint, _dumps(continuation))
+        kind, payload = await asyncio.wrap_future(future)
+        value = pickle.loads(payload)
+        if kind == _KIND_ERROR:
+            raise value
+
+        result: TResult = value
+        return result
+
+
+def dispatch_to_remote(
+    endpoint: Endpoint, *, pool: Optional[RemotePool] = None
+) -> _RemoteAwaitable:
+    """Continue the rest of the function on a remote worker.
+
+    `endpoint` is either a `(host, port)` tuple or a path of a Unix socket.
+    Local variables of the function are copied to the worker, so changes made
+    by the worker are not visible to the caller except the return value.
+    """
+    if sys.version_info < (3, 8):
+        raise RuntimeError("dispatch_to_remote requires Python 3.8 or later")
+
+    return _RemoteAwaitable(endpoint, pool)
+
+
+async def _run_request(
+    writer: asyncio.StreamWriter,
+    drain_lock: asyncio.Lock,
+    request_id: int,
+    payload: bytes,
+) -> None:
+    try:
+        continuation = pickle.loads(payload)
+        result = await continuation()
+        kind, response = _KIND_RESULT, _dumps(result)
+    except Exception as e:
+        kind, response = _KIND_ERROR, _dumps_error(e)
+
+    _write_frame(writer, kind, request_id, response)
+    async with drain_lock:
+        await writer.drain()
+
+
+async def _handle_connection(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, authkey: bytes
+) -> None:
+    tasks: Set[asyncio.Future[None]] = set()
+    drain_lock = asyncio.Lock()
+    try:
+        authenticated = await asyncio.wait_for(
+            _worker_handshake(reader, writer, authkey), _HANDSHAKE_TIMEOUT
+        )
+        if not authenticated:
+            return
+
+        while True:
+            kind, request_id, payload = await _read_frame(reader)
+            if kind != _KIND_CALL:
+                raise ValueError(f"Unexpected frame kind: {kind}")
+
+            task = asyncio.ensure_future(
+                _run_request(writer, drain_lock, request_id, payload)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        for pending_task in list(tasks):
+            pending_task.cancel()
+        writer.close()
+
+
+async def serve(
+    endpoint: Endpoint, *, authkey: Optional[bytes] = None
+) -> asyncio.AbstractServer:
+    """Start a worker that runs continuations sent by `dispatch_to_remote`.
+
+    Only callers that know `authkey` can send continuations. If it is not given,
+    the AWAITER_AUTHKEY environment variable is used.
+    """
+    handler = partial(_handle_connection, authkey=_get_authkey(authkey))
+    if isinstance(endpoint, str):
+        return await asyncio.start_unix_server(handler, endpoint)
+    else:
+        host, port = endpoint
+        return await asyncio.start_server(handler, host, port)
+
+
+async def _serve_forever(endpoint: Endpoint) -> None:
+    server = await serve(endpoint)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Run an awaiter remote worker. "
+            f"The authentication key is read from {_AUTHKEY_ENV}."
+        )
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="Listen on the given Unix socket path")
+    args = parser.parse_args(argv)
+
+    if len(os.environ.get(_AUTHKEY_ENV, "")) == 0:
+        parser.error(f"{_AUTHKEY_ENV} environment variable is required")
+
+    endpoint: Endpoint = args.unix if args.unix is not None else (args.host, args.port)
+    asyncio.run(_serve_forever(endpoint))
@@ -0,0 +1,328 @@
+"""Synchronization primitives that can be shared among event loops and threads.
+
+Unlike the primitives in `asyncio`, these are not bound to a specific loop,
+so a coroutine can keep using them after hopping to another loop or executor.
+The internal state is guarded by a `threading.Lock` held only for short
+critical sections, and waiters are woken on their own loop.
+A released permit (or an item) is handed directly to the next waiter,
+so each contention path needs at most one cross-thread wakeup.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import deque
+from types import TracebackType
+from typing import Any, Deque, Generic, Optional, Type, TypeVar
+
+T = TypeVar("T")
+
+
+def _get_running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _resolve(future: asyncio.Future[Any], value: Any) -> None:
+    if not future.done():
+        future.set_result(value)
+
+
+class _Waiter:
+    def __init__(self, item: Any = None) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.future: asyncio.Future[Any] = self.loop.create_future()
+        self.granted = False
+        # An item to be put (for putters) or the received value (for getters)
+        self.item = item
+        self.value: Any = None
+
+    def wake(self, value: Any = None) -> bool:
+        """Grant the waiter and schedule its wakeup on its own loop.
+
+        This method must be called while holding the lock of the primitive.
+        Returns False if the waiter can no longer be woken up.
+        """
+        if self.future.done():
+            # Cancelled, but it has not been removed from the queue yet
+            return False
+
+        if self.loop is _get_running_loop():
+            self.future.set_result(value)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(_resolve, self.future, value)
+            except RuntimeError:
+                # The loop of the waiter is already closed
+                return False
+
+        self.granted = True
+        self.value = value
+        return True
+
+
+def _discard_waiter(waiters: Deque[_Waiter], waiter: _Waiter) -> None:
+    # NOTE: A cancelled waiter may have been already popped by a release (or put)
+    # that skipped it because its `wake` returned False
+    try:
+        waiters.remove(waiter)
+    except ValueError:
+        pass
+
+
+class Semaphore:
+    """A semaphore that any number of loops and threads can await."""
+
+    def __init__(self, value: int = 1) -> None:
+        if value < 0:
+            raise ValueError("Semaphore initial value must be >= 0")
+
+        self._mutex = threading.Lock()
+        self._value = value
+        self._waiters: Deque[_Waiter] = deque()
+
+    def locked(self) -> bool:
+        with self._mutex:
+            return self._value == 0
+
+    async def acquire(self) -> bool:
+        with self._mutex:
+            if self._value > 0 and len(self._waiters) == 0:
+                self._value -= 1
+                return True
+
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._mutex:
+                if waiter.granted:
+                    # Pass the permit on since it was handed to the cancelled waiter
+                    self._release_locked()
+                else:
+                    _discard_waiter(self._waiters, waiter)
+            raise
+
+        return True
+
+    def _release_locked(self) -> None:
+        while len(self._waiters) > 0:
+            if self._waiters.popleft().wake():
+                return
+
+        self._value += 1
+
+    def release(self) -> None:
+        with self._mutex:
+            self._release_locked()
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        self.release()
+
+
+class Lock(Semaphore):
+    """A lock that any number of loops and threads can await."""
+
+    def __init__(self) -> None:
+        super().__init__(1)
+
+    def release(self) -> None:
+        with self._mutex:
+            if self._value > 0:
+                raise RuntimeError("Lock is not acquired")
+            self._release_locked()
+
+
+class Event:
+    """An event that any number of loops and threads can await."""
+
+    def __init__(self) -> None:
+        self._mutex = threading.Lock()
+        self._flag = False
+        self._waiters: Deque[_Waiter] = deque()
+
+    def is_set(self) -> bool:
+        return self._flag
+
+    def set(self) -> None:
+        with self._mutex:
+            self._flag = True
+            while len(self._waiters) > 0:
+                self._waiters.popleft().wake()
+
+    def clear(self) -> None:
+        with self._mutex:
+            self._flag = False
+
+    async def wait(self) -> bool:
+        with self._mutex:
+            if self._flag:
+                return True
+
+            waiter = _Waiter()
+            self._waiters.append(waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._mutex:
+                if not waiter.granted:
+                    _discard_waiter(self._waiters, waiter)
+            raise
+
+        return True
+
+
+class Queue(Generic[T]):
+    """A FIFO queue that any number of loops and threads can await.
+
+    If `maxsize` is less than or equal to zero, the queue size is infinite.
+    Unlike `asyncio.Queue`, the item of a cancelled `put` may have been already
+    enqueued, and the item received by a cancelled `get` is returned to the head
+    of the queue even if the queue is full.
+    """
+
+    def __init__(self, maxsize: int = 0) -> None:
+        self._mutex = threading.Lock()
+        self._maxsize = maxsize
+        self._items: Deque[T] = deque()
+        self._getters: Deque[_Waiter] = deque()
+        self._putters: Deque[_Waiter] = deque()
+        self._unfinished_tasks = 0
+        self._finished = Event()
+        self._finished.set()
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def qsize(self) -> int:
+        with self._mutex:
+            return len(self._items)
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        if self._maxsize <= 0:
+            return False
+
+        return self.qsize() >= self._maxsize
+
+    def _is_full_locked(self) -> bool:
+        return self._maxsize > 0 and len(self._items) >= self._maxsize
+
+    def _add_task_locked(self) -> None:
+        self._unfinished_tasks += 1
+        self._finished.clear()
+
+    def _put_locked(self, item: T) -> bool:
+        # Hand the item to a getter directly if any
+        while len(self._getters) > 0:
+            if self._getters.popleft().wake(item):
+                self._add_task_locked()
+                return True
+
+        if self._is_full_locked():
+            return False
+
+        self._items.append(item)
+        self._add_task_locked()
+        return True
+
+    def _get_locked(self) -> T:
+        item = self._items.popleft()
+        # Move the item of a blocked putter into the freed slot
+        while len(self._putters) > 0:
+            putter = self._putters.popleft()
+            if putter.wake():
+                self._items.append(putter.item)
+                self._add_task_locked()
+                break
+
+        return item
+
+    def _put_back_locked(self, item: T) -> None:
+        # Return an item received by a cancelled getter to the head of the queue
+        while len(self._getters) > 0:
+            if self._getters.popleft().wake(item):
+                return
+
+        self._items.appendleft(item)
+
+    def put_nowait(self, item: T) -> None:
+        with self._mutex:
+            if not self._put_locked(item):
+                raise asyncio.QueueFull()
+
+    async def put(self, item: T) -> None:
+        with self._mutex:
+            if self._put_locked(item):
+                return
+
+            waiter = _Waiter(item)
+            self._putters.append(waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._mutex:
+                if not waiter.granted:
+                    _discard_waiter(self._putters, waiter)
+            # NOTE: If the waiter is already granted, the item has been enqueued
+            raise
+
+    def get_nowait(self) -> T:
+        with self._mutex:
+            if len(self._items) == 0:
+                raise asyncio.QueueEmpty()
+            return self._get_locked()
+
+    async def get(self) -> T:
+        with self._mutex:
+            if len(self._items) > 0:
+                return self._get_locked()
+
+            waiter = _Waiter()
+            self._getters.append(waiter)
+
+        try:
+            item: T = await waiter.future
+        except asyncio.CancelledError:
+            with self._mutex:
+                if waiter.granted:
+                    # Give the item back so that it won't be lost
+                    self._put_back_locked(waiter.value)
+                else:
+                    _discard_waiter(self._getters, waiter)
+            raise
+
+        return item
+
+    def task_done(self) -> None:
+        """Indicate that an item retrieved from the queue has been processed."""
+        with self._mutex:
+            if self._unfinished_tasks <= 0:
+                raise ValueError("task_done() called too many times")
+
+            self._unfinished_tasks -= 1
+            if self._unfinished_tasks == 0:
+                self._finished.set()
+
+    async def join(self) -> None:
+        """Wait until all the items put into the queue have been processed."""
+        if self._unfinished_tasks > 0:
+            await self._finished.wait()
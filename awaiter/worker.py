@@ -0,0 +1,4 @@
+from .remote import main
+
+if __name__ == "__main__":
+    main()
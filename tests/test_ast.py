@@ -1,9 +1,16 @@
+import ast
 import asyncio
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Awaitable, Callable, Generator, Optional
 
 import pytest
 
-from awaiter import use_awaiter
+from awaiter import use_awaiter, warm_up_awaiters
+from awaiter.ast.async_cps_transformer import transform_async_to_cps
+from awaiter.ast.decorator_remover import remove_decorator
 
 
 class _TestAwaitable:
@@ -79,3 +86,104 @@ async def test_method() -> None:
     assert awaitable.called
     assert awaitable.continuation is not None
     assert await awaitable.continuation() == 32
+
+
+@pytest.mark.asyncio
+async def test_lazy() -> None:
+    offset = 1
+
+    @use_awaiter(lazy=True)
+    async def _lazy_func(awaitable: _TestAwaitable, value: int) -> int:
+        await asyncio.sleep(0.01)
+        await awaitable
+        value += offset
+        return value
+
+    assert _lazy_func.__name__ == "_lazy_func"
+    assert _lazy_func.__code__.co_name == "stub"
+
+    # Concurrent first calls from multiple threads should be safe
+    with ThreadPoolExecutor() as executor:
+        awaitables = [_TestAwaitable() for _ in range(8)]
+        results = executor.map(
+            lambda a: asyncio.run(_lazy_func(a, 10)),
+            awaitables,
+        )
+        assert list(results) == [11] * 8
+        assert all(a.called for a in awaitables)
+
+    # The stub should be replaced with the transformed function
+    assert _lazy_func.__code__.co_name == "_lazy_func"
+
+    awaitable = _TestAwaitable()
+    assert await _lazy_func(awaitable, 20) == 21
+    assert awaitable.called
+
+
+@pytest.mark.asyncio
+async def test_warm_up() -> None:
+    @use_awaiter(lazy=True)
+    async def _lazy_func(awaitable: _TestAwaitable) -> int:
+        await awaitable
+        return 1
+
+    transformer = _lazy_func.__globals__["__awaiter_transformer__"]
+    assert transformer.pending
+
+    thread = warm_up_awaiters()
+    assert isinstance(thread, threading.Thread)
+    thread.join()
+    assert not transformer.pending
+    assert _lazy_func.__code__.co_name == "_lazy_func"
+    assert warm_up_awaiters(background=False) is None
+
+    awaitable = _TestAwaitable()
+    assert await _lazy_func(awaitable) == 1
+    assert awaitable.called
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failure(caplog: pytest.LogCaptureFixture) -> None:
+    @use_awaiter(deco_name="unknown_decorator", lazy=True)
+    async def _lazy_func(awaitable: _TestAwaitable) -> int:
+        await awaitable
+        return 1
+
+    assert warm_up_awaiters(background=False) is None
+    assert "Failed to transform" in caplog.text
+
+    # The error should be raised on the first call
+    with pytest.raises(RuntimeError, match="Failed to find decorator"):
+        await _lazy_func(_TestAwaitable())
+
+
+def _measure_decoration_time(n_awaits: int) -> float:
+    lines = ["@awaiter.use_awaiter", "async def _generated(awaitable):"]
+    for _ in range(n_awaits):
+        lines.append("    await awaitable")
+    lines.append("    return 1")
+    source = "\n".join(lines)
+
+    elapsed = float("inf")
+    gc_enabled = gc.isenabled()
+    # NOTE: Disable GC to make the measurement stable
+    gc.disable()
+    try:
+        for _ in range(3):
+            start = time.perf_counter()
+            module_ast = transform_async_to_cps(ast.parse(source))
+            remove_decorator(module_ast, "awaiter.use_awaiter")
+            compile(module_ast, "<awaiter>", "exec")
+            elapsed = min(elapsed, time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return elapsed
+
+
+def test_decoration_time_is_linear() -> None:
+    small = _measure_decoration_time(200)
+    large = _measure_decoration_time(1600)
+    # 8x larger function should take roughly 8x longer (with a margin for noise)
+    assert large / small < 8 * 2
@@ -1,12 +1,18 @@
 import asyncio
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from typing import Iterator
+from typing import Any, Callable, Iterator, List, Sequence, Tuple, cast
 
 import asyncx
 import pytest
 
-from awaiter import detach, dispatch_to_executor, dispatch_to_loop, use_awaiter
+from awaiter import (
+    detach,
+    dispatch_to_executor,
+    dispatch_to_loop,
+    fan_out,
+    use_awaiter,
+)
 
 
 @pytest.fixture
@@ -95,3 +101,101 @@ async def test_detach(loop: asyncx.EventLoopThread) -> None:
     assert detach_obj.task is not None
     await detach_obj.task
     assert callee_completed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_fan_out(
+    executor: ThreadPoolExecutor, loop: asyncx.EventLoopThread
+) -> None:
+    @use_awaiter
+    async def method(values: List[int]) -> Any:
+        original_ident = threading.get_ident()
+        fan = fan_out(values, [executor, loop.loop])
+        await fan
+        assert original_ident != threading.get_ident()
+
+        await asyncio.sleep(0.01)
+        return [v * 2 for v in fan.chunk]
+
+    values = list(range(100))
+    chunks = cast(List[List[int]], await method(values))
+    assert len(chunks) > 2
+    assert [v for chunk in chunks for v in chunk] == [v * 2 for v in values]
+    # Chunk sizes should shrink as the remaining work decreases
+    assert len(chunks[0]) >= len(chunks[-1])
+    assert await method([]) == []
+
+
+@pytest.mark.asyncio
+async def test_fan_out_locals(executor: ThreadPoolExecutor) -> None:
+    @use_awaiter
+    async def method(values: List[int]) -> Any:
+        base = 1000
+        fan = fan_out(values, [executor] * 4)
+        await fan
+
+        # Local variables are independent among chunks
+        total = base + sum(fan.chunk)
+        await asyncio.sleep(0.01)
+        total += len(fan.chunk)
+        await asyncio.sleep(0.01)
+        return total, list(fan.chunk)
+
+    results = cast(List[Any], await method(list(range(100))))
+    assert len(results) > 1
+    for total, chunk in results:
+        assert total == 1000 + sum(chunk) + len(chunk)
+
+
+@pytest.mark.asyncio
+async def test_fan_out_shared_closure(executor: ThreadPoolExecutor) -> None:
+    def make_counter() -> Tuple[Callable[[], None], Callable[[], int]]:
+        count = 0
+        lock = threading.Lock()
+
+        def increment() -> None:
+            nonlocal count
+            with lock:
+                count += 1
+
+        def get() -> int:
+            return count
+
+        return increment, get
+
+    @use_awaiter
+    async def method(values: List[int], increment: Callable[[], None]) -> Any:
+        fan = fan_out(values, [executor] * 4)
+        await fan
+
+        # Closures given by the caller are shared among chunks
+        for _ in fan.chunk:
+            increment()
+        return len(fan.chunk)
+
+    increment, get = make_counter()
+    results = cast(List[int], await method(list(range(20)), increment))
+    assert sum(results) == 20
+    assert get() == 20
+
+
+@pytest.mark.asyncio
+async def test_fan_out_error(executor: ThreadPoolExecutor) -> None:
+    started: List[Sequence[int]] = []
+
+    @use_awaiter
+    async def method(values: List[int]) -> Any:
+        fan = fan_out(values, [executor] * 2)
+        await fan
+
+        started.append(fan.chunk)
+        if 0 in fan.chunk:
+            raise ValueError("failed")
+        await asyncio.sleep(0.05)
+
+    with pytest.raises(ValueError, match="failed"):
+        await method(list(range(20)))
+
+    # No more chunks are started after the failure
+    await asyncio.sleep(0.3)
+    assert len(started) == 2
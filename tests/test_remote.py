@@ -0,0 +1,250 @@
+import asyncio
+import os
+import pathlib
+import pickle
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pytest
+
+from awaiter import RemotePool, dispatch_to_remote, use_awaiter
+from awaiter.remote import AuthenticationError, _dumps
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parent.parent
+AUTHKEY = b"test-authkey"
+ENV = dict(os.environ, PYTHONPATH=str(ROOT_DIR), AWAITER_AUTHKEY=AUTHKEY.decode())
+
+
+def _start_worker(
+    args: List[str], connect: Callable[[], None]
+) -> "subprocess.Popen[bytes]":
+    process = subprocess.Popen([sys.executable, "-m", "awaiter.worker", *args], env=ENV)
+    deadline = time.monotonic() + 10.0
+    while True:
+        try:
+            connect()
+            return process
+        except OSError:
+            if time.monotonic() > deadline:
+                process.terminate()
+                process.wait()
+                raise
+            time.sleep(0.05)
+
+
+@pytest.fixture
+def endpoint(tmp_path: pathlib.Path) -> Iterator[str]:
+    path = str(tmp_path / "worker.sock")
+
+    def connect() -> None:
+        with socket.socket(socket.AF_UNIX) as s:
+            s.connect(path)
+
+    process = _start_worker(["--unix", path], connect)
+    try:
+        yield path
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def tcp_endpoint() -> Iterator[Tuple[str, int]]:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        host, port = s.getsockname()
+
+    def connect() -> None:
+        socket.create_connection((host, port)).close()
+
+    process = _start_worker(["--host", host, "--port", str(port)], connect)
+    try:
+        yield host, port
+    finally:
+        process.terminate()
+        process.wait()
+
+
+@pytest.fixture
+def pool() -> Iterator[RemotePool]:
+    with RemotePool(max_connections=2, authkey=AUTHKEY) as pool:
+        yield pool
+
+
+@pytest.mark.asyncio
+async def test_dispatch_to_remote(endpoint: str, pool: RemotePool) -> None:
+    original_pid = os.getpid()
+
+    @use_awaiter
+    async def method(arg: int) -> Tuple[int, int]:
+        value = 10
+        assert os.getpid() == original_pid
+
+        await dispatch_to_remote(endpoint, pool=pool)
+        assert os.getpid() != original_pid
+
+        value += 1
+        value += arg
+        await asyncio.sleep(0.01)
+        return value, os.getpid()
+
+    value, pid = await method(5)
+    assert value == 16
+    assert pid != original_pid
+
+    # Many continuations are pipelined on a limited number of connections
+    results: List[Tuple[int, int]] = await asyncio.gather(
+        *(method(i) for i in range(50))
+    )
+    assert [v for v, _ in results] == [11 + i for i in range(50)]
+
+
+@pytest.mark.asyncio
+async def test_dispatch_to_remote_error(endpoint: str, pool: RemotePool) -> None:
+    @use_awaiter
+    async def method() -> None:
+        await dispatch_to_remote(endpoint, pool=pool)
+        raise ValueError("raised on the worker")
+
+    with pytest.raises(ValueError, match="raised on the worker"):
+        await method()
+
+
+_MAIN_SCRIPT = """
+import asyncio
+import os
+import pickle
+import sys
+
+from awaiter import RemotePool, dispatch_to_remote, use_awaiter
+
+
+class Counter:
+    def __init__(self, value):
+        self.value = value
+
+    def increment(self):
+        return Counter(self.value + 1)
+
+
+def helper(value):
+    return Counter(value * 3).increment().value
+
+
+endpoint = (sys.argv[1], int(sys.argv[2]))
+pool = RemotePool()
+
+
+@use_awaiter
+async def method(value):
+    await dispatch_to_remote(endpoint, pool=pool)
+    return helper(value), os.getpid()
+
+
+with pool:
+    result, pid = asyncio.run(method(5))
+    assert pid != os.getpid()
+    print(result)
+"""
+
+
+def test_dispatch_to_remote_from_main(
+    tcp_endpoint: Tuple[str, int], tmp_path: pathlib.Path
+) -> None:
+    # Objects defined in `__main__` of the caller should be sent by value
+    script = tmp_path / "script.py"
+    script.write_text(_MAIN_SCRIPT)
+    host, port = tcp_endpoint
+    output = subprocess.check_output(
+        [sys.executable, str(script), host, str(port)],
+        env=ENV,
+        timeout=30,
+    )
+    assert output.decode().strip() == "16"
+
+
+@pytest.mark.asyncio
+async def test_dispatch_to_remote_wrong_authkey(tcp_endpoint: Tuple[str, int]) -> None:
+    pool = RemotePool(authkey=b"wrong-authkey")
+
+    @use_awaiter
+    async def method() -> None:
+        await dispatch_to_remote(tcp_endpoint, pool=pool)
+        raise AssertionError("Should not be executed")
+
+    with pool:
+        with pytest.raises(AuthenticationError):
+            await method()
+
+
+@pytest.mark.asyncio
+async def test_dispatch_to_remote_version_mismatch(
+    endpoint: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr("awaiter.remote._version_tag", lambda: b"cpython-00:0")
+    pool = RemotePool(authkey=AUTHKEY)
+
+    @use_awaiter
+    async def method() -> None:
+        await dispatch_to_remote(endpoint, pool=pool)
+        raise AssertionError("Should not be executed")
+
+    with pool:
+        with pytest.raises(RuntimeError, match="Python version mismatch"):
+            await method()
+
+
+def test_remote_pool_requires_authkey(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("AWAITER_AUTHKEY", raising=False)
+    with pytest.raises(ValueError):
+        RemotePool()
+
+
+_RECURSIVE_SOURCE = """
+def factorial(n):
+    return 1 if n <= 1 else n * factorial(n - 1)
+
+
+def first(n):
+    return 0 if n == 0 else second(n - 1) + 1
+
+
+def second(n):
+    return 0 if n == 0 else third(n - 1) + 1
+
+
+def third(n):
+    return 0 if n == 0 else first(n - 1) + 1
+
+
+def run(n):
+    return factorial(n), first(n)
+
+
+def use_pool():
+    return pool.submit
+"""
+
+
+def test_dumps_main_functions() -> None:
+    # Functions that cannot be imported on the worker are sent by value
+    namespace: Dict[str, Any] = {"__name__": "__main__"}
+    exec(_RECURSIVE_SOURCE, namespace)
+
+    # Recursive and mutually recursive functions are serialized only once each
+    run = pickle.loads(_dumps(namespace["run"]))
+    assert run(5) == (120, 5)
+
+
+def test_dumps_caller_only_global() -> None:
+    namespace: Dict[str, Any] = {"__name__": "__main__"}
+    exec(_RECURSIVE_SOURCE, namespace)
+    with RemotePool(authkey=AUTHKEY) as pool:
+        namespace["pool"] = pool
+        use_pool = pickle.loads(_dumps(namespace["use_pool"]))
+
+    with pytest.raises(NameError, match="'pool'"):
+        use_pool()
@@ -0,0 +1,213 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List
+
+import asyncx
+import pytest
+
+from awaiter import (
+    Event,
+    Lock,
+    Queue,
+    Semaphore,
+    dispatch_to_executor,
+    dispatch_to_loop,
+    use_awaiter,
+)
+
+
+@pytest.fixture
+def executor() -> Iterator[ThreadPoolExecutor]:
+    with ThreadPoolExecutor() as executor:
+        yield executor
+
+
+@pytest.fixture
+def loop() -> Iterator[asyncx.EventLoopThread]:
+    with asyncx.EventLoopThread() as thread:
+        yield thread
+
+
+@pytest.mark.asyncio
+async def test_lock(executor: ThreadPoolExecutor, loop: asyncx.EventLoopThread) -> None:
+    lock = Lock()
+    counter: List[int] = [0]
+
+    async def increment() -> None:
+        async with lock:
+            value = counter[0]
+            await asyncio.sleep(0.001)
+            counter[0] = value + 1
+
+    @use_awaiter
+    async def on_executor() -> None:
+        await dispatch_to_executor(executor)
+        for _ in range(10):
+            await increment()
+
+    @use_awaiter
+    async def on_loop() -> None:
+        await dispatch_to_loop(loop.loop)
+        for _ in range(10):
+            await increment()
+
+    async def on_original_loop() -> None:
+        for _ in range(10):
+            await increment()
+
+    await asyncio.gather(on_executor(), on_loop(), on_original_loop())
+    assert counter[0] == 30
+    assert not lock.locked()
+
+    with pytest.raises(RuntimeError):
+        lock.release()
+
+
+@pytest.mark.asyncio
+async def test_semaphore_cancel() -> None:
+    semaphore = Semaphore(1)
+    await semaphore.acquire()
+
+    waiter = asyncio.ensure_future(semaphore.acquire())
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    # The permit should not be lost by the cancellation
+    semaphore.release()
+    await asyncio.wait_for(semaphore.acquire(), timeout=1.0)
+    assert semaphore.locked()
+
+    # Release from another thread wakes up the waiter on this loop
+    waiter = asyncio.ensure_future(semaphore.acquire())
+    await asyncio.sleep(0.01)
+    threading.Thread(target=semaphore.release).start()
+    assert await asyncio.wait_for(waiter, timeout=1.0)
+
+
+@pytest.mark.asyncio
+async def test_event(loop: asyncx.EventLoopThread) -> None:
+    event = Event()
+    woken_idents: List[int] = []
+
+    async def wait() -> None:
+        await event.wait()
+        woken_idents.append(threading.get_ident())
+
+    other = asyncio.run_coroutine_threadsafe(wait(), loop.loop)
+    local = asyncio.ensure_future(wait())
+    await asyncio.sleep(0.01)
+    assert not event.is_set()
+
+    threading.Thread(target=event.set).start()
+    await asyncio.wait_for(local, timeout=1.0)
+    await asyncio.wait_for(asyncio.wrap_future(other), timeout=1.0)
+    assert event.is_set()
+    assert loop.ident is not None
+    assert sorted(woken_idents) == sorted([threading.get_ident(), loop.ident])
+
+    event.clear()
+    assert not event.is_set()
+
+
+@pytest.mark.asyncio
+async def test_queue(loop: asyncx.EventLoopThread) -> None:
+    queue: Queue[int] = Queue(maxsize=2)
+
+    async def produce() -> None:
+        for i in range(100):
+            await queue.put(i)
+
+    producer = asyncio.run_coroutine_threadsafe(produce(), loop.loop)
+    items = [await asyncio.wait_for(queue.get(), timeout=1.0) for _ in range(100)]
+    await asyncio.wrap_future(producer)
+    assert items == list(range(100))
+    assert queue.empty()
+
+    queue.put_nowait(1)
+    queue.put_nowait(2)
+    assert queue.full()
+    with pytest.raises(asyncio.QueueFull):
+        queue.put_nowait(3)
+    assert queue.get_nowait() == 1
+    assert queue.get_nowait() == 2
+    with pytest.raises(asyncio.QueueEmpty):
+        queue.get_nowait()
+
+
+@pytest.mark.asyncio
+async def test_semaphore_cancel_then_release() -> None:
+    semaphore = Semaphore(0)
+    waiter = asyncio.ensure_future(semaphore.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    # The cancelled waiter is skipped and the permit is kept
+    semaphore.release()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+    assert not semaphore.locked()
+    assert await asyncio.wait_for(semaphore.acquire(), timeout=1.0)
+
+
+@pytest.mark.asyncio
+async def test_event_cancel_then_set() -> None:
+    event = Event()
+    waiter = asyncio.ensure_future(event.wait())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    event.set()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+
+
+@pytest.mark.asyncio
+async def test_queue_cancel_then_put() -> None:
+    queue: Queue[int] = Queue(maxsize=1)
+    getter = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    getter.cancel()
+    # The cancelled getter is skipped and the item stays in the queue
+    queue.put_nowait(1)
+    with pytest.raises(asyncio.CancelledError):
+        await getter
+
+    assert queue.get_nowait() == 1
+
+    queue.put_nowait(2)
+    putter = asyncio.ensure_future(queue.put(3))
+    await asyncio.sleep(0)
+    putter.cancel()
+    # The cancelled putter is skipped and its item is not enqueued
+    assert queue.get_nowait() == 2
+    with pytest.raises(asyncio.CancelledError):
+        await putter
+
+    assert queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_queue_join(loop: asyncx.EventLoopThread) -> None:
+    queue: Queue[int] = Queue()
+    await asyncio.wait_for(queue.join(), timeout=1.0)
+    processed: List[int] = []
+
+    async def consume() -> None:
+        for _ in range(10):
+            item = await queue.get()
+            await asyncio.sleep(0.001)
+            processed.append(item)
+            queue.task_done()
+
+    consumer = asyncio.run_coroutine_threadsafe(consume(), loop.loop)
+    for i in range(10):
+        await queue.put(i)
+
+    await asyncio.wait_for(queue.join(), timeout=1.0)
+    assert processed == list(range(10))
+    await asyncio.wrap_future(consumer)
+
+    with pytest.raises(ValueError):
+        queue.task_done()